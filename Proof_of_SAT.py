@@ -2,129 +2,199 @@
 """
 Methods to generate and solve random instances of SAT and instances of SAT that are deterministically and pseudo-randomly
 generated from the solutions of previous MAX-SAT instances. This is a prototype of how a proof of work algorithm can be
-derived from a relevant problem.
+derived from a relevant problem. Requires NumPy and Numba (pip install numpy numba).
 https://github.com/DevonFulcher/Proof-of-SAT
 @author: Devon Fulcher
 """
 from hashlib import sha256
 import itertools
-import json
-import random
 
+from numba import njit, prange
+import numpy as np
 
-# Generates all possible clauses of the boolean satisfiability problem with given parameters as a
-# list of clauses. The variables are represented as nonzero integers with
+
+# Generates all possible clauses of the boolean satisfiability problem with given parameters as an
+# int8 array with one row per clause. The variables are represented as nonzero integers with
 # negative integers representing negated variables.
 def all_possible_clauses(num_variables_per_clause, num_variables_per_instance):
-    positive_or_negative = itertools.product(range(2), repeat=num_variables_per_instance)
-    all_possible_clauses = []
-    for combination in positive_or_negative:
-        literals = []
-        for variable in range(num_variables_per_instance):
-            if combination[variable] == 1:
-                literals.append(variable + 1)
-            else:
-                literals.append(-(variable + 1))
-        clauses = list(itertools.combinations(literals, num_variables_per_clause))
-        for clause in clauses:
-            if clause not in all_possible_clauses:
-                all_possible_clauses.append(clause)
-    num_bits_required = len(bin(len(all_possible_clauses))[2:])
+    literals = [literal for variable in range(1, num_variables_per_instance + 1) for literal in (variable, -variable)]
+    all_possible_clauses = np.array([clause for clause in itertools.combinations(literals, num_variables_per_clause)
+                                     if len({abs(literal) for literal in clause}) == num_variables_per_clause],
+                                    dtype=np.int8)
+    num_bits_required = (len(all_possible_clauses) - 1).bit_length()
     return all_possible_clauses, num_bits_required
 
 
 # Returns a random instance of SAT with the given number of clauses
 def random_sat(all_possible_clauses, num_clauses):
-    sat_instance = []
-    for _ in range(num_clauses):
-        sat_instance.append(all_possible_clauses[random.randint(0, len(all_possible_clauses))])
-    return sat_instance
+    all_possible_clauses = np.asarray(all_possible_clauses, dtype=np.int8)
+    return all_possible_clauses[np.random.randint(0, len(all_possible_clauses), num_clauses)]
+
+
+# Packs each clause of an instance of SAT into two bitmasks of the variables that appear in it, one of the variables
+# that appear positively and one of the variables that appear negated. Variable 1 is the most significant of the
+# num_variables_per_instance bits so that an assignment packed into an integer is ordered like itertools.product.
+def clause_masks(clauses, num_variables_per_instance):
+    literals = np.asarray(clauses, dtype=np.int8)
+    bits = np.uint64(1) << (num_variables_per_instance - np.abs(literals).astype(np.int64)).astype(np.uint64)
+    positive_masks = np.bitwise_or.reduce(np.where(literals > 0, bits, np.uint64(0)), axis=1)
+    negative_masks = np.bitwise_or.reduce(np.where(literals < 0, bits, np.uint64(0)), axis=1)
+    return positive_masks, negative_masks
+
+
+# Counts the number of clauses, given as bitmasks by clause_masks, that each packed variable assignment satisfies.
+# The assignments are independent so they are counted in parallel.
+@njit(cache=True, parallel=True)
+def num_clauses_satisfied(positive_masks, negative_masks, assignments):
+    num_clauses_satisfied = np.zeros(len(assignments), dtype=np.int64)
+    for i in prange(len(assignments)):
+        assignment = assignments[i]
+        for j in range(len(positive_masks)):
+            if (assignment & positive_masks[j]) | (~assignment & negative_masks[j]):
+                num_clauses_satisfied[i] += 1
+    return num_clauses_satisfied
+
+
+# Splits an instance of SAT into the index of the variable of each literal and the value that variable must take for
+# the literal to be true. Both are arrays with one row per clause and one column per literal.
+def literal_arrays(clauses):
+    literals = np.asarray(clauses, dtype=np.int8)
+    variable_indices = np.abs(literals).astype(np.int64) - 1
+    polarities = (literals > 0).astype(np.uint8)
+    return variable_indices, polarities
+
+
+# Flips variables of an assignment, WalkSAT style, until it satisfies at least num_clauses_required clauses. Each flip
+# picks an unsatisfied clause at random and flips, with probability noise, a random variable of that clause and
+# otherwise the variable of that clause that unsatisfies the fewest other clauses. The number of true literals of each
+# clause is updated incrementally from the clauses that the flipped variable appears in. Returns the assignment and the
+# number of flips.
+@njit(cache=True)
+def walksat(variable_indices, polarities, assignment, num_clauses_required, noise, seed):
+    np.random.seed(seed)
+    num_clauses, num_variables_per_clause = variable_indices.shape
+    # the clauses that each variable appears in, and the polarity it appears with, indexed by offsets
+    offsets = np.zeros(len(assignment) + 1, dtype=np.int64)
+    for clause in range(num_clauses):
+        for literal in range(num_variables_per_clause):
+            offsets[variable_indices[clause, literal] + 1] += 1
+    offsets = np.cumsum(offsets)
+    variable_clauses = np.empty(num_clauses * num_variables_per_clause, dtype=np.int64)
+    variable_polarities = np.empty(num_clauses * num_variables_per_clause, dtype=np.uint8)
+    next_offset = offsets[:-1].copy()
+    for clause in range(num_clauses):
+        for literal in range(num_variables_per_clause):
+            variable = variable_indices[clause, literal]
+            variable_clauses[next_offset[variable]] = clause
+            variable_polarities[next_offset[variable]] = polarities[clause, literal]
+            next_offset[variable] += 1
+    num_true_literals = np.zeros(num_clauses, dtype=np.int64)
+    unsatisfied_clauses = np.empty(num_clauses, dtype=np.int64)
+    unsatisfied_positions = np.empty(num_clauses, dtype=np.int64)
+    num_unsatisfied = 0
+    for clause in range(num_clauses):
+        for literal in range(num_variables_per_clause):
+            if assignment[variable_indices[clause, literal]] == polarities[clause, literal]:
+                num_true_literals[clause] += 1
+        if num_true_literals[clause] == 0:
+            unsatisfied_clauses[num_unsatisfied] = clause
+            unsatisfied_positions[clause] = num_unsatisfied
+            num_unsatisfied += 1
+    num_flips = 0
+    while num_clauses - num_unsatisfied < num_clauses_required:
+        clause = unsatisfied_clauses[np.random.randint(num_unsatisfied)]
+        if np.random.random() < noise:
+            flipped_variable = variable_indices[clause, np.random.randint(num_variables_per_clause)]
+        else:
+            fewest_breaks = num_clauses + 1
+            flipped_variable = -1
+            for literal in range(num_variables_per_clause):
+                variable = variable_indices[clause, literal]
+                breaks = 0
+                for i in range(offsets[variable], offsets[variable + 1]):
+                    if (num_true_literals[variable_clauses[i]] == 1
+                            and assignment[variable] == variable_polarities[i]):
+                        breaks += 1
+                if breaks < fewest_breaks:
+                    fewest_breaks = breaks
+                    flipped_variable = variable
+        assignment[flipped_variable] = 1 - assignment[flipped_variable]
+        for i in range(offsets[flipped_variable], offsets[flipped_variable + 1]):
+            affected_clause = variable_clauses[i]
+            if assignment[flipped_variable] == variable_polarities[i]:
+                num_true_literals[affected_clause] += 1
+                if num_true_literals[affected_clause] == 1:
+                    # swap the now satisfied clause with the last unsatisfied clause and drop it
+                    num_unsatisfied -= 1
+                    last_clause = unsatisfied_clauses[num_unsatisfied]
+                    unsatisfied_clauses[unsatisfied_positions[affected_clause]] = last_clause
+                    unsatisfied_positions[last_clause] = unsatisfied_positions[affected_clause]
+            else:
+                num_true_literals[affected_clause] -= 1
+                if num_true_literals[affected_clause] == 0:
+                    unsatisfied_clauses[num_unsatisfied] = affected_clause
+                    unsatisfied_positions[affected_clause] = num_unsatisfied
+                    num_unsatisfied += 1
+        num_flips += 1
+    return assignment, num_flips
 
 
 # Solves at least 1 - 1 / 2**num_variables_per_clause fraction of the clauses of an instance of boolean satisfiability. Returns
 # a list of bits corresponding to the values of each variable that satisfy the MAX-Sat instance. If randomized = True
-# then this method will check variable assignments at random else it will check variable assignments with brute force
-def max_sat_solver(clauses, num_variables_per_instance, randomized=True):
+# then this method will search from a random variable assignment by flipping one variable at a time with walksat, counting
+# every assignment reached as an attempt, else it will check variable assignments with brute force. Brute force
+# assignments are packed into integers and checked batch_size at a time.
+def max_sat_solver(clauses, num_variables_per_instance, randomized=True, batch_size=1024, noise=0.5):
+    num_variables_per_clause = len(clauses[0])
+    # the fewest clauses that are at least 1 - 1 / 2**num_variables_per_clause of all clauses
+    num_clauses_required = -(-(2**num_variables_per_clause - 1) * len(clauses) // 2**num_variables_per_clause)
     if randomized:
-        def variable_assignment(num_assignment_attempts):
-            assignment = ()
-            for _ in range(num_variables_per_instance):
-                assignment += random.randint(0, 1),
-            return assignment
-    else:
-        product = list(itertools.product(range(2), repeat=num_variables_per_instance))
-        def variable_assignment(num_assignment_attempts):
-            return product[num_assignment_attempts]
-    max_sat_solved = False
+        variable_indices, polarities = literal_arrays(clauses)
+        assignment = np.random.randint(0, 2, num_variables_per_instance, dtype=np.uint8)
+        seed = np.random.randint(2**31)
+        assignment, num_flips = walksat(variable_indices, polarities, assignment, num_clauses_required, noise, seed)
+        return tuple(assignment.tolist()), num_flips + 1
+    positive_masks, negative_masks = clause_masks(clauses, num_variables_per_instance)
     num_assignment_attempts = 0
-    while not max_sat_solved:
-        assignment = variable_assignment(num_assignment_attempts)
-        num_clauses_satisfied = 0
-        for clause in clauses:
-            for literal in clause:
-                if literal > 0:
-                    if assignment[literal - 1] == 1:
-                        num_clauses_satisfied += 1
-                        break
-                else:
-                    if assignment[-literal - 1] == 0:
-                        num_clauses_satisfied += 1
-                        break
-        num_assignment_attempts += 1
-        if num_clauses_satisfied / len(clauses) >= 1 - 1 / 2**num_variables_per_clause:
-            max_sat_solved = True
-    return assignment, num_assignment_attempts
+    while True:
+        stop = min(num_assignment_attempts + batch_size, 2**num_variables_per_instance)
+        assignments = np.arange(num_assignment_attempts, stop, dtype=np.uint64)
+        max_sat_solved = num_clauses_satisfied(positive_masks, negative_masks, assignments) >= num_clauses_required
+        if max_sat_solved.any():
+            hit = int(np.argmax(max_sat_solved))
+            assignment = int(assignments[hit])
+            assignment = tuple((assignment >> (num_variables_per_instance - variable)) & 1
+                               for variable in range(1, num_variables_per_instance + 1))
+            return assignment, num_assignment_attempts + hit + 1
+        num_assignment_attempts += len(assignments)
 
 
 # Turns a list of binary digits, as representation of an assignment of variables in the
-# MAX-SAT problem, into a deterministically pseudo-random instance of the SAT problem
+# MAX-SAT problem, into a deterministically pseudo-random instance of the SAT problem. The digits are hashed
+# as one byte each.
 def solution_to_sat(assignment, all_possible_clauses, num_bits_required):
-    block_string = json.dumps(assignment)
-    digest = sha256(block_string.encode()).hexdigest()
-    # this is the bitstring that will encode the new instance of SAT
-    digest_in_binary = bin(int(digest, 16))[2:].zfill(256)
-    new_clauses = []
-    current_binary_substring = ""
-    bit_index = 0
-    while bit_index < len(digest_in_binary) and len(new_clauses) <= len(all_possible_clauses):
-        current_binary_substring += digest_in_binary[bit_index]
-        if len(current_binary_substring) == num_bits_required:
-            location_of_clause = int(current_binary_substring, 2)
-            while location_of_clause >= len(all_possible_clauses):
-                bit_index += 1
-                if bit_index == len(digest_in_binary):
-                    break
-                current_binary_substring = current_binary_substring[1:] + digest_in_binary[bit_index]
-                location_of_clause = int(current_binary_substring, 2)
-            if location_of_clause < len(all_possible_clauses):
-                new_clauses.append(all_possible_clauses[location_of_clause])
-            current_binary_substring = ""
-        bit_index += 1
-    return new_clauses
+    all_possible_clauses = np.asarray(all_possible_clauses, dtype=np.int8)
+    digest = sha256(bytes(assignment)).digest()
+    # these are the 256 bits that will encode the new instance of SAT, read as digits in base len(all_possible_clauses)
+    # that each locate a clause. There are at most 2**num_bits_required clauses so the digest has at least
+    # 256 // num_bits_required such digits.
+    locations_of_clauses = int.from_bytes(digest, 'big')
+    locations_of_new_clauses = []
+    for _ in range(256 // num_bits_required):
+        locations_of_clauses, location_of_clause = divmod(locations_of_clauses, len(all_possible_clauses))
+        locations_of_new_clauses.append(location_of_clause)
+    return all_possible_clauses[locations_of_new_clauses]
 
 
 # Replaces each variable in an instance of SAT with a boolean assignment of that variable
 def assignment_in_clauses(clauses, assignment):
-    assignment_in_clauses = []
-    for clause in clauses:
-        assignment_in_clause = []
-        for literal in clause:
-            if literal > 0:
-                if assignment[literal - 1] == 1:
-                    assignment_in_clause.append(1)
-                else:
-                    assignment_in_clause.append(0)
-            else:
-                if assignment[-literal - 1] == 1:
-                    assignment_in_clause.append(0)
-                else:
-                    assignment_in_clause.append(1)
-        assignment_in_clauses.append(assignment_in_clause)
-    return assignment_in_clauses
+    variable_indices, polarities = literal_arrays(clauses)
+    assignment = np.array(assignment, dtype=np.uint8)
+    return (assignment[variable_indices] == polarities).astype(np.int8).tolist()
 
 
 if __name__ == "__main__":
-    random.seed(1)
+    np.random.seed(1)
     num_starting_clauses = 7
     num_variables_per_instance = 7
     num_variables_per_clause = 3
@@ -132,12 +202,13 @@ if __name__ == "__main__":
     print_display = True
     assert num_variables_per_clause >= 3
     assert num_variables_per_instance >= num_variables_per_clause
+    assert num_variables_per_instance <= 64
     all_possible_clauses, num_bits_required = all_possible_clauses(num_variables_per_clause, num_variables_per_instance)
     assert num_starting_clauses < len(all_possible_clauses)
     clauses = random_sat(all_possible_clauses, num_starting_clauses)
     for i in range(num_instances):
         if print_display:
-            print("clauses:", clauses)
+            print("clauses:", clauses.tolist())
         assignment, num_assignment_attempts = max_sat_solver(clauses, num_variables_per_instance, True)
         if print_display:
             print("assignment:", assignment)